@@ -2,8 +2,21 @@ import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 import datetime as dt
+import warnings
+from collections import namedtuple
+from functools import lru_cache
+from scipy.linalg import svd as sp_svd
+from scipy.linalg.blas import dsyrk
+from scipy.stats import describe as sp_describe
 
-def poincare_plot(bf, aft, reg_params_bf=None, reg_params_aft=None, bf_title=None, aft_title=None):
+try:
+    from numba import njit
+except ImportError: #The decomposition still works without numba, only slower
+    def njit(*args, **kwargs):
+        return lambda func: func
+
+def poincare_plot(bf, aft, reg_params_bf=None, reg_params_aft=None, bf_title=None, aft_title=None,
+                  max_points=5000, density=False):
     """Creates a two-plot subplot showing the Poincaré plots of the measurements before and after
     some point in time.
     
@@ -23,6 +36,12 @@ def poincare_plot(bf, aft, reg_params_bf=None, reg_params_aft=None, bf_title=Non
     
     -aft_title: Title for the graph of the 'after' period
     
+    -max_points: Int. If a period has more points than this, a random (but reproducible) sample of 
+    max_points of them is drawn instead, which keeps rendering fast. If None all points are drawn.
+    
+    -density: Bool. If True the points are drawn as a hexagonal density plot instead of a scatter
+    plot, and max_points is ignored.
+    
     Returns:
     -None; plots the graphs."""
     
@@ -45,23 +64,36 @@ def poincare_plot(bf, aft, reg_params_bf=None, reg_params_aft=None, bf_title=Non
     fig.suptitle('Poincaré Diagrams', fontsize=15)
 
     #Poincaré scatter plot
-    ax[0].scatter(bf_orig,bf_shift)
-    ax[1].scatter(aft_orig, aft_shift)
+    rng = np.random.default_rng(0)
+    for axis, orig, shift in ((ax[0], bf_orig, bf_shift), (ax[1], aft_orig, aft_shift)):
+        if density:
+            axis.hexbin(orig, shift, gridsize=50, mincnt=1)
+            continue
+        
+        if max_points is not None and len(orig) > max_points:
+            idx = rng.choice(len(orig), max_points, replace=False)
+            orig, shift = orig[idx], shift[idx]
+        #Rasterizing the points keeps saved vector figures small, while axes and text stay vector
+        axis.scatter(orig, shift, s=4, marker='.', rasterized=True)
+    
+    #Both lines are straight, so only their endpoints are needed
+    xs_bf = np.array([np.nanmin(bf_orig), np.nanmax(bf_orig)])
+    xs_aft = np.array([np.nanmin(aft_orig), np.nanmax(aft_orig)])
     
     if reg_params_bf is not None:
         #Linear regression
-        ax[0].plot(bf_orig, b0_bf + b1_bf*bf_orig, color = 'red',
+        ax[0].plot(xs_bf, b0_bf + b1_bf*xs_bf, color = 'red',
                      label = r'$x_{n + 1} = $' + str_b0_bf + ' + ' + str_b1_bf + r'$x_n$')
         #Identity line
-        ax[0].plot(bf_orig, bf_orig, color='orange', label=r'$x_{n + 1} = x_n$')
+        ax[0].plot(xs_bf, xs_bf, color='orange', label=r'$x_{n + 1} = x_n$')
         ax[0].legend()
         
     if reg_params_aft is not None:
         #Linear regression
-        ax[1].plot(aft_orig, b0_aft + b1_aft*aft_orig, color = 'red',
+        ax[1].plot(xs_aft, b0_aft + b1_aft*xs_aft, color = 'red',
                      label = r'$x_{n + 1} = $' + str_b0_aft + ' + ' + str_b1_aft + r'$x_n$')
         #Identity line
-        ax[1].plot(aft_orig, aft_orig, color='orange', label=r'$x_{n + 1} = x_n$')
+        ax[1].plot(xs_aft, xs_aft, color='orange', label=r'$x_{n + 1} = x_n$')
         ax[1].legend()
     
     
@@ -76,6 +108,40 @@ def poincare_plot(bf, aft, reg_params_bf=None, reg_params_aft=None, bf_title=Non
         
 ##################################################################################################################################################################################
         
+def _summ_stats(series):
+    """Computes the same statistics as the describe method, plus the skew and kurtosis, with
+    scipy's describe (a single pass) and one call to np.quantile for the percentiles.
+    
+    Arguments:
+    -series: Pandas Series object containing measurements.
+    
+    Returns:
+    -Pandas Series object with the statistics, in the same order as describe.
+    """
+    a = series.dropna().to_numpy(dtype=np.float64)
+    if len(a) < 4:
+        #Too few values for the unbiased kurtosis (or skew, or std). scipy falls back to other
+        #values or raises here, so pandas computes them instead; with so few values it is cheap.
+        desc = pd.Series(a, dtype=np.float64).describe()
+        desc['skew'] = pd.Series(a, dtype=np.float64).skew()
+        desc['kurtosis'] = pd.Series(a, dtype=np.float64).kurtosis()
+        return desc
+    
+    with warnings.catch_warnings():
+        #scipy warns about precision loss for constant data; those moments are set below
+        warnings.simplefilter('ignore', RuntimeWarning)
+        d = sp_describe(a, bias=False) #Unbiased skew and kurtosis, as pandas computes them
+    q = np.quantile(a, [0.25, 0.5, 0.75])
+    
+    skew, kurtosis = d.skewness, d.kurtosis
+    if d.minmax[0] == d.minmax[1]: #Zero variance: pandas defines both as 0
+        skew, kurtosis = 0.0, 0.0
+    
+    return pd.Series({'count':float(d.nobs), 'mean':d.mean, 'std':np.sqrt(d.variance),
+                      'min':d.minmax[0], '25%':q[0], '50%':q[1], '75%':q[2], 'max':d.minmax[1],
+                      'skew':skew, 'kurtosis':kurtosis})
+    
+    
 def summ_stats_compare(bf, aft, bf_title='2019', aft_title='2020'):
     """Computes all summary statistics given in the describe method, plus the skew and kurtosis,
     for the two arguments and returns them as a single dataframe.
@@ -90,13 +156,8 @@ def summ_stats_compare(bf, aft, bf_title='2019', aft_title='2020'):
     """
     
     #Calculating the statistics for both Series
-    bf_desc = bf.describe()
-    bf_desc['skew'] = bf.skew()
-    bf_desc['kurtosis'] = bf.kurtosis()
-    
-    aft_desc = aft.describe()
-    aft_desc['skew'] = aft.skew()
-    aft_desc['kurtosis'] = aft.kurtosis()
+    bf_desc = _summ_stats(bf)
+    aft_desc = _summ_stats(aft)
     
     #Creating the df
     
@@ -108,29 +169,53 @@ def summ_stats_compare(bf, aft, bf_title='2019', aft_title='2020'):
 ##################################################################################################################################################################################
 
 
-def traj_matrix_SVD(X, window):
+def traj_matrix_SVD(X, window, compute_uv=True, method='svd'):
     """Calculates the trajectory matrix and performs SVD for the scree diagram.
     
     Arguments:
     X: Array-like containing pollutant measurements
     window: Int. The number of rows, corresponding to a specific period of time, by default
     24 for one day.
+    compute_uv: Bool. If False only the singular values are computed, which is all the scree 
+    diagram needs.
+    method: String, 'svd' or 'gram'. 'gram' requires compute_uv to be False. With 'gram' the singular
+    values are obtained as the square roots of the eigenvalues of the small (window x window)
+    matrix A*A^T, which is much cheaper than the SVD of the trajectory matrix itself.
     
     Returns:
-    U, V: The left and right matrices of SVD respectively
+    U, V: The left and right matrices of SVD respectively (reduced form). Only returned if
+    compute_uv is True.
     S: The vector of singular values.
     """
      
-    A = [] #The trajectory matrix
+    if method not in ('svd', 'gram'):
+        raise ValueError(f"method must be 'svd' or 'gram', got {method!r}")
+    if method == 'gram' and compute_uv:
+        raise ValueError("method='gram' only computes the singular values; use compute_uv=False")
+    
     col = len(X) - window #Number of columns
-    for i in range(col):
-        A.append(X[i:i+window])
-    A = np.array(A)
-    A = A.T
+    #The trajectory (Hankel) matrix is built as a view over X instead of copying every window
+    A = np.lib.stride_tricks.sliding_window_view(np.ascontiguousarray(X), window_shape=window)
+    A = A[:col].T
     
     assert A.shape == (window, col)
     
-    U,S,V = np.linalg.svd(A)
+    if not compute_uv:
+        if method == 'gram':
+            #Only the upper triangle of A*A^T is computed, which is all eigvalsh reads
+            C = dsyrk(1.0, A)
+            s2 = np.linalg.eigvalsh(C, UPLO='U')[::-1] #Descending, as returned by svd
+            S = np.sqrt(np.clip(s2, 0, None))
+        else:
+            S = sp_svd(np.array(A, dtype=np.float64, order='F'), full_matrices=False, compute_uv=False,
+                       overwrite_a=True, check_finite=False, lapack_driver='gesdd')
+        return S.reshape(-1, 1)
+    
+    #A is a view of X, so LAPACK always gets its own Fortran-ordered copy (np.array copies even when
+    #A is already Fortran-ordered, e.g. window == 1), which it can then overwrite instead of copying
+    #again. The reduced SVD avoids allocating the (col x col) right matrix
+    U,S,V = sp_svd(np.array(A, dtype=np.float64, order='F'), full_matrices=False, overwrite_a=True,
+                   check_finite=False, lapack_driver='gesdd')
     S = S.reshape(-1, 1)
     
     return U,S,V
@@ -139,14 +224,10 @@ def traj_matrix_SVD(X, window):
 ##################################################################################################################################################################################
 
 
-def half_month_ticks():
-    """Creates a pandas index of tick positions at the 1st and 15th of every month, alongside a list 
-    of their labels
-    
-    Returns:
-    tick_pos: Pandas index object with tick positions.
-    tick_labels = List with the labels corresponding to tick_pos.
-    """
+@lru_cache(maxsize=None)
+def _half_month_ticks():
+    """Builds the ticks returned by half_month_ticks. The dates are fixed, so the result is cached;
+    the labels are returned as a tuple so the cached value cannot be mutated."""
     
     #Craeating tick positions
     tick_dates = [[dt.datetime(2020,i,1), dt.datetime(2020,i,15)] for i in range(1,5)]
@@ -167,7 +248,21 @@ def half_month_ticks():
         day = str(i.day)
         tick_labels.append(mon_name + '-' + day)
         
-    return tick_pos, tick_labels
+    return tick_pos, tuple(tick_labels)
+
+
+def half_month_ticks():
+    """Creates a pandas index of tick positions at the 1st and 15th of every month, alongside a list 
+    of their labels
+    
+    Returns:
+    tick_pos: Pandas index object with tick positions.
+    tick_labels = List with the labels corresponding to tick_pos.
+    """
+    
+    tick_pos, tick_labels = _half_month_ticks()
+    
+    return tick_pos, list(tick_labels)
 
 
 
@@ -192,4 +287,83 @@ def seasonal_plot(res, axes, title=None):
     res.resid.plot(ax=axes[3], legend=False)
     axes[3].set_ylabel('Residual')
     
-    return axes
\ No newline at end of file
+    return axes
+
+
+##################################################################################################################################################################################
+
+
+DecomposeResult = namedtuple('DecomposeResult', ['observed', 'trend', 'seasonal', 'resid'])
+
+
+#Compiled functions are cached on disk so they are only compiled once, not in every session
+@njit(cache=True)
+def _centered_ma(x, period):
+    """Centered moving average of length period (a 2 x period one if period is even), the same
+    filter used by seasonal_decompose. The ends where the window does not fit are left as NaN."""
+    
+    n = len(x)
+    half = period // 2
+    trend = np.full(n, np.nan)
+    
+    for i in range(half, n - half):
+        acc = 0.0
+        if period % 2 == 0:
+            acc += 0.5*(x[i - half] + x[i + half])
+            for j in range(i - half + 1, i + half):
+                acc += x[j]
+        else:
+            for j in range(i - half, i + half + 1):
+                acc += x[j]
+        trend[i] = acc / period
+        
+    return trend
+
+
+@njit(cache=True)
+def _phase_means(detrended, period):
+    """Mean of the detrended values at each phase of the period, ignoring NaN, centered so that
+    the seasonal component adds up to zero over one period."""
+    
+    acc = np.zeros(period)
+    count = np.zeros(period)
+    for i in range(len(detrended)):
+        if not np.isnan(detrended[i]):
+            acc[i % period] += detrended[i]
+            count[i % period] += 1
+            
+    means = acc / count
+    return means - means.mean()
+
+
+def fast_seasonal(x, period=24):
+    """Additive decomposition equivalent to statsmodels' seasonal_decompose with its default
+    arguments, computed with JIT compiled loops. The result can be passed to seasonal_plot.
+    
+    Arguments:
+    -x: Pandas Series object (or array-like) with the measurements.
+    -period: Int. The period of the seasonal component, by default 24 for one day of hourly data.
+    
+    Returns:
+    -res: DecomposeResult with the observed, trend, seasonal and resid Pandas Series objects.
+    """
+    
+    observed = x if isinstance(x, pd.Series) else pd.Series(x)
+    values = observed.to_numpy(dtype=np.float64)
+    
+    #Same restrictions as seasonal_decompose, without which the phase means are undefined
+    if np.isnan(values).any():
+        raise ValueError('This function does not handle missing values')
+    if len(values) < 2*period:
+        raise ValueError(f'x must have 2 complete cycles requires {2*period} observations. '
+                         f'x only has {len(values)} observation(s)')
+    
+    trend = _centered_ma(values, period)
+    phase_means = _phase_means(values - trend, period)
+    seasonal = np.tile(phase_means, len(values) // period + 1)[:len(values)]
+    resid = values - trend - seasonal
+    
+    index = observed.index
+    
+    return DecomposeResult(observed, pd.Series(trend, index=index), 
+                           pd.Series(seasonal, index=index), pd.Series(resid, index=index))
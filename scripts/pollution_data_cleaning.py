@@ -1,3 +1,8 @@
+import pandas as pd
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from os.path import join as pathjoin
+
 def columns_to_datetime(df):
     """Creates a new df with a datetime columns and values corresponding to the concentration of a pollutant
     at said datetime.
@@ -5,35 +10,19 @@ def columns_to_datetime(df):
     df: A dataframe with different columns for pollutant concentration per hour of the day, named
     in the format h01, h02, etc."""
     
-    import pandas as pd
-    import numpy as np
-    import datetime
-    from warnings import filterwarnings
-    filterwarnings('ignore')
+    hour_cols = ['h0'+str(i) if i<10 else 'h'+str(i) for i in range(1,25)]
+    n = len(df)
     
-    hours = ('h0'+str(i) if i<10 else 'h'+str(i) for i in range(1,25))
-    df_hours = []
-    df = df.reindex(np.sort(df.columns), axis = 1) #To prevent issues coming from columns
-    #being in a different order when I pass a list of columns later on
+    #The hour columns are placed one below the other, so every output column is allocated once
+    #and filled in 24 blocks of n rows, without intermediate dfs.
+    new_df = df[['contaminante', 'estacion']].take(np.tile(np.arange(n), 24)).reset_index(drop=True)
+    new_df['concentracion'] = df[hour_cols].to_numpy().T.reshape(-1)
     
-    for hour, hour_str in enumerate(hours):
-        hour = hour + 1
-        
-        #Creating a df with only the values of the corresponding hour
-        columns = ['contaminante', 'estacion', 'fecha', hour_str]
-        df_hour = df[columns]
-        
-        #The hour is appended to the date
-        df_hour['dt'] = df_hour['fecha'].apply(lambda x:datetime.datetime(x.year, x.month, x.day, hour%24))
-        df_hour.drop(columns=['fecha'], inplace=True)
-        
-        #Changing the name of the concentration column to avoid problems
-        df_hour.rename(columns={hour_str:'concentracion'}, inplace = True)
-        
-        #The df is appended to the list
-        df_hours.append(df_hour)
+    #The hour is appended to the date
+    hours = (np.arange(1,25) % 24).astype('timedelta64[h]')
+    new_df['dt'] = (df['fecha'].values.astype('datetime64[D]') + hours[:, None]).reshape(-1)
     
-    new_df = pd.concat(df_hours).sort_values('dt').reset_index(drop=True)
+    new_df = new_df.sort_values('dt').reset_index(drop=True)
     assert len(new_df) == 24*len(df)
     
     return new_df
@@ -48,29 +37,26 @@ def clean_data(csv_list):
     csv_list: An iterable containing the paths to the files containing the data, one month per file.
     """
     
-    import pandas as pd
-    import numpy as np
-    from warnings import filterwarnings
-    filterwarnings('ignore')
-    
-    dfs = [pd.read_csv(csv, sep=';') for csv in csv_list]
+    #Only the needed columns are read. PUNTO_MUESTREO, PROVINCIA and MUNICIPIO will not be used,
+    #and the validation columns (V01, V02, etc.) are ignored since some data are not validated.
+    hour_cols = ['H0'+str(i) if i<10 else 'H'+str(i) for i in range(1,25)]
+    keep = ['ANO', 'MES', 'DIA', 'MAGNITUD', 'ESTACION'] + hour_cols
+    dtype = {col:'float32' for col in hour_cols}
+    dtype.update({'ANO':'int16', 'MES':'int8', 'DIA':'int8', 'MAGNITUD':'int8', 'ESTACION':'int16'})
+    
+    #The C parser releases the GIL, so the monthly files can be read concurrently
+    with ThreadPoolExecutor() as executor:
+        dfs = list(executor.map(lambda csv:pd.read_csv(csv, sep=';', usecols=keep, dtype=dtype),
+                                csv_list))
     df = pd.concat(dfs)
     del dfs
 
-    #The following columns will not be used and are removed
-    df.drop(columns = ['PUNTO_MUESTREO', 'PROVINCIA', 'MUNICIPIO'], inplace = True)
     df.columns = df.columns.str.lower()
 
-    #Some data are not validated, but that will be ignored
-    df.drop(columns = ['v0'+str(i) if i<10 else 'v'+str(i) for i in range(1,25)], inplace = True)
-
     #Creating a date column
-    anios = df['ano'].astype('str')
-    meses = df['mes'].astype('str')
-    dias = df['dia'].astype('str')
-    fechas_str = anios + '-' + meses + '-' + dias
-
-    df['fecha'] = pd.to_datetime(fechas_str, yearfirst=True)
+    df['fecha'] = pd.to_datetime(df[['ano','mes','dia']].rename(columns={'ano':'year',
+                                                                       'mes':'month',
+                                                                       'dia':'day'}))
     df.drop(columns=['ano','mes','dia'], inplace=True)
 
     #A column with the name of each pollutant is created
@@ -85,7 +71,7 @@ def clean_data(csv_list):
     not_used = {i:np.nan for i in (7,12,20,30,35,42,43,44)}
     pollutants_dict = {**used, **not_used}
 
-    df['contaminante'] = df['magnitud'].apply(lambda x:pollutants_dict[x])
+    df['contaminante'] = df['magnitud'].map(pollutants_dict).astype('category')
     df.drop(columns=['magnitud'], inplace = True)
     df = df.dropna().reset_index(drop=True)
     
@@ -93,9 +79,7 @@ def clean_data(csv_list):
     #environment of the city and could therefore be registering outlier values. It will be 
     #removed.
     
-    LaGuardia = df[df['estacion'] == 54].index
-    df.drop(index=LaGuardia, inplace=True)
-    df = df.reset_index(drop=True)
+    df = df.loc[df['estacion'] != 54].reset_index(drop=True)
     
     #A new df is created with only one column for the pollutant concentration.
     #Another new column with the date and hour is created.
@@ -105,9 +89,10 @@ def clean_data(csv_list):
     return clean_df
     
 
-def create_pollutant_csvs(clean_df):
-    """Creates csv files containing the data for each pollutant individually.
-    The resultant csv's first column will be a datetime index.
+def create_pollutant_files(clean_df):
+    """Creates parquet files containing the data for each pollutant individually.
+    The resultant files are indexed by datetime. Parquet keeps the column types, so
+    the dates do not have to be parsed again when the files are read.
     
     IMPORTANT: The function assumes data from only one year. Otherwise the
     filename will be nonindicative of its true contents.
@@ -115,20 +100,26 @@ def create_pollutant_csvs(clean_df):
     Arguments:
     clean_df: The df obtained from the clean_data function."""
     
-    import pandas as pd
-    from os.path import join as pathjoin
-    
     year = clean_df['dt'].dt.year.unique()[0].astype(str)
     save_dir = input('Write the path to the directory where the files will be saved.\n')
 
-    for pollutant in clean_df['contaminante'].unique():
-        pollut_df = clean_df[clean_df['contaminante'] == pollutant].copy()
-        pollut_df.drop(columns=['contaminante'], inplace=True)
+    def save_pollutant(group):
+        pollutant, pollut_df = group
+        pollut_df = pollut_df.drop(columns=['contaminante'])
         pollut_df.set_index('dt', inplace = True)
-        save_path = pathjoin(save_dir, f'{pollutant}-{year}.csv')
+        save_path = pathjoin(save_dir, f'{pollutant}-{year}.parquet')
             
-        pollut_df.to_csv(save_path)
+        pollut_df.to_parquet(save_path, engine='pyarrow', compression='zstd')
+    
+    #The files are independent of each other, so they are written concurrently. The results are
+    #consumed so that any error while writing is raised here.
+    with ThreadPoolExecutor() as executor:
+        list(executor.map(save_pollutant, clean_df.groupby('contaminante', observed=True)))
             
+
+#Kept for code written before the files were saved as parquet
+create_pollutant_csvs = create_pollutant_files
+
             
 if __name__ == '__main__':
     from sys import argv
@@ -138,6 +129,6 @@ if __name__ == '__main__':
         exit
         
     clean_df = clean_data(argv[1:])
-    create_pollutant_csvs(clean_df)
+    create_pollutant_files(clean_df)
         
     